@@ -2,11 +2,11 @@
 OCR API endpoints.
 Converts images of mathematical formulas to LaTeX.
 """
-from fastapi import APIRouter, File, UploadFile, HTTPException
+from fastapi import APIRouter, File, UploadFile, HTTPException, Request
 from app.models.formula import OCRResponse
 from PIL import Image
-from pix2text import Pix2Text
-import io
+from pix2text import TextFormulaOCR
+import asyncio
 import logging
 import time
 
@@ -17,21 +17,68 @@ logger = logging.getLogger(__name__)
 # Results below this threshold are rejected with 400 error
 CONFIDENCE_THRESHOLD = 0.6
 
+# Uploads larger than this are rejected with 413 before any decoding
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+
+# Longest image side we need for recognition; JPEGs are downsampled
+# towards this by libjpeg while decoding
+MAX_IMAGE_SIDE = 1600
+
 # ========================================
 # Module-Level Model Initialization
 # ========================================
 # This runs ONCE when the server starts, not per-request
+#
+# Only the text+formula engine is loaded: the full Pix2Text pipeline also
+# loads layout-analysis and table models that formula OCR never uses.
+# Formula detection (MFD) and recognition (MFR) run on ONNX Runtime.
+P2T_CONFIG = {
+    "mfd": {"model_backend": "onnx"},
+    "formula": {"model_backend": "onnx"},
+}
 try:
     logger.info("Initializing Pix2Text model...")
-    p2t = Pix2Text.from_config()
+    p2t = TextFormulaOCR.from_config(P2T_CONFIG)
     logger.info("✅ Pix2Text model loaded successfully")
 except Exception as e:
     logger.error(f"❌ Failed to initialize Pix2Text: {e}")
     p2t = None  # Allow server to start even if model fails
 
 
+def _decode_and_recognize(fp) -> list:
+    """
+    Decode the uploaded image and run Pix2Text on it.
+
+    Runs on the OCR thread pool: decode, resizing and inference are all
+    blocking, and the image is read straight from the upload's spooled file
+    rather than copied into an in-memory buffer first.
+    """
+    try:
+        image = Image.open(fp)
+        image.draft("RGB", (MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        image.load()
+        logger.debug(f"Image decoded: size={image.size}, mode={image.mode}")
+    except Exception as e:
+        logger.error(f"Invalid image file: {e}")
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid image file"
+        )
+
+    # Recognition cost scales with pixel count, so cap large photos/screenshots
+    # and hand Pix2Text RGB up front instead of letting it convert internally
+    if max(image.size) > MAX_IMAGE_SIDE:
+        image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.LANCZOS)
+        logger.debug(f"Image downscaled to {image.size}")
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    # return_text=False returns dict {'text': '...', 'score': 0.98} instead of just string
+    return p2t.recognize(image, return_text=False, use_post_process=True)
+
+
 @router.post("/ocr", response_model=OCRResponse)
-async def extract_latex(file: UploadFile = File(...)):
+async def extract_latex(request: Request, file: UploadFile = File(...)):
     """
     Extract LaTeX from uploaded formula image using Pix2Text.
 
@@ -44,6 +91,7 @@ async def extract_latex(file: UploadFile = File(...)):
     Raises:
         HTTPException 503: Pix2Text model not initialized
         HTTPException 400: Invalid image file or confidence below threshold
+        HTTPException 413: Upload larger than MAX_UPLOAD_BYTES
         HTTPException 500: OCR processing failed
     """
     # Log request
@@ -58,59 +106,56 @@ async def extract_latex(file: UploadFile = File(...)):
         )
 
     try:
-        # Read uploaded file
-        contents = await file.read()
-        logger.debug(f"File read successfully: {len(contents)} bytes")
-
-        # Convert to PIL Image
-        try:
-            image = Image.open(io.BytesIO(contents))
-            logger.debug(f"Image decoded: size={image.size}, mode={image.mode}")
-        except Exception as e:
-            logger.error(f"Invalid image file: {e}")
+        # Reject oversized uploads before touching the image data
+        if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+            logger.warning(f"OCR upload too large: {file.size} bytes > {MAX_UPLOAD_BYTES}")
             raise HTTPException(
-                status_code=400,
-                detail="Invalid image file"
+                status_code=413,
+                detail=f"Image too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)} MB)"
             )
 
-        # Run OCR with post-processing
-        # return_text=False returns dict {'text': '...', 'score': 0.98} instead of just string
+        # Decode and run OCR with post-processing on the OCR thread pool so
+        # neither blocks the event loop for other requests
         start_time = time.time()
-        result = p2t.recognize_text_formula(image, return_text=False, use_post_process=True)
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(request.app.state.ocr_pool, _decode_and_recognize, file.file)
         ocr_duration = time.time() - start_time
 
-        # Log full result object for debugging
-        logger.info(f"OCR raw result (type={type(result).__name__}, count={len(result) if isinstance(result, list) else 'N/A'}):")
-        if isinstance(result, list):
-            for i, item in enumerate(result):
-                # Convert position numpy array to list for readable logging
-                position_str = item.get('position', []).tolist() if hasattr(item.get('position', []), 'tolist') else item.get('position', [])
-                logger.info(f"  [{i}] type={item.get('type')!r}, line={item.get('line_number')}, score={item.get('score', 0):.3f}")
-                logger.info(f"       text={item.get('text')!r}")
-                logger.info(f"       position={position_str}")
-        else:
-            logger.info(f"  {result}")
-            
-            
+        # Log full result object for debugging — skipped entirely unless DEBUG
+        # is enabled, since it formats every element and converts numpy positions
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("OCR raw result (type=%s, count=%s):", type(result).__name__,
+                         len(result) if isinstance(result, list) else 'N/A')
+            if isinstance(result, list):
+                for i, item in enumerate(result):
+                    # Convert position numpy array to list for readable logging
+                    position = item.get('position', [])
+                    position_str = position.tolist() if hasattr(position, 'tolist') else position
+                    logger.debug("  [%d] type=%r, line=%s, score=%.3f", i, item.get('type'), item.get('line_number'), item.get('score', 0))
+                    logger.debug("       text=%r", item.get('text'))
+                    logger.debug("       position=%s", position_str)
+            else:
+                logger.debug("  %s", result)
+
         # todo: if multiple formulas detected, there will be multiple isolateds
-        # handle later
-        
-        max_conf = float("-inf")
-        res = None
-        for i in range(len(result)):
-            element = result[i]
-            if element.get('type') == "isolated":
-                confidence = float(element.get('score'))
-                if ((confidence) > max_conf):
-                    max_conf = confidence
-                    res = element
-        result = res    
-        
-                
-
-        # Extract LaTeX and confidence score from result
+        # handle later — for now keep the most confident one
+        detected = len(result)
+        result = max(
+            (e for e in result if e.get('type') == "isolated"),
+            key=lambda e: e.get('score', 0.0),
+            default=None,
+        )
+        if result is None:
+            logger.warning("OCR found no isolated formula in image")
+            raise HTTPException(
+                status_code=400,
+                detail="No formula detected in image"
+            )
+
+        # Extract LaTeX and confidence score from result — same 0.0 default as
+        # the max() above, so an unscored element fails the threshold below
         latex = result.get('text', '')
-        confidence = result.get('score', 1.0)
+        confidence = result.get('score', 0.0)
 
         # Reject low-confidence results
         if confidence < CONFIDENCE_THRESHOLD:
@@ -121,7 +166,8 @@ async def extract_latex(file: UploadFile = File(...)):
             )
 
         # Log success
-        logger.info(f"OCR succeeded: latex_length={len(latex)}, confidence={confidence:.2f}, duration={ocr_duration:.2f}s")
+        logger.info("OCR succeeded: detected=%d, latex_length=%d, confidence=%.2f, duration=%.2fs",
+                    detected, len(latex), confidence, ocr_duration)
         logger.debug(f"OCR result: {latex}")
 
         return OCRResponse(
@@ -0,0 +1,53 @@
+"""
+OCR proxy endpoint.
+Forwards formula images to the standalone OCR service (app.ocr_main) so API
+workers don't each load the Pix2Text model.
+"""
+from fastapi import APIRouter, File, UploadFile, HTTPException, Request
+from app.models.formula import OCRResponse
+import httpx
+import logging
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+@router.post("/ocr", response_model=OCRResponse)
+async def extract_latex(request: Request, file: UploadFile = File(...)):
+    """
+    Extract LaTeX from uploaded formula image via the OCR service.
+
+    Args:
+        file: Image file (JPEG/PNG) via multipart/form-data
+
+    Returns:
+        OCRResponse from the OCR service
+
+    Raises:
+        HTTPException 503: OCR service unreachable
+        HTTPException 4xx/5xx: Passed through from the OCR service
+    """
+    client: httpx.AsyncClient = request.app.state.ocr_http
+    contents = await file.read()
+
+    try:
+        resp = await client.post(
+            "/api/ocr",
+            files={"file": (file.filename, contents, file.content_type)},
+        )
+    except httpx.HTTPError as e:
+        logger.error(f"OCR service request failed: {type(e).__name__}: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail="OCR service unavailable"
+        )
+
+    if resp.status_code != 200:
+        try:
+            body = resp.json()
+            detail = body.get("detail", resp.text) if isinstance(body, dict) else resp.text
+        except ValueError:
+            detail = resp.text
+        raise HTTPException(status_code=resp.status_code, detail=detail)
+
+    return OCRResponse.model_validate_json(resp.content)
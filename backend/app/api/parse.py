@@ -3,47 +3,238 @@ Parse API endpoints.
 Generates micro (syntax) and macro (semantic) representations of formulas.
 """
 from fastapi import APIRouter, HTTPException, Request
-from fastapi.responses import StreamingResponse
-from app.models.formula import FormulaData, TestParseResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from app.config import settings
+from app.models.formula import ComponentBreakdown, FormulaData, TestParseResponse
 from app.api.parse_prompt import PARSE_PROMPT
-from app.api.parse_schema import PARSE_SCHEMA
+from app.api.parse_schema import PARSE_TEXT_FORMAT
 from app.api.parse_utils import merge_fragmented_components
 from app.services.formulaTranslation import convertParseResponse
+from collections import OrderedDict
 import asyncio
+import hashlib
 import uuid
-import json
 import logging
+import orjson
 import time
 from pathlib import Path
 
-router = APIRouter()
+router = APIRouter(default_response_class=ORJSONResponse)
 logger = logging.getLogger("app.api.parse")
 
-_DEBUG_LOG = Path(__file__).parent.parent.parent / "logs" / "parse_debug.jsonl"
+_LOG_DIR = Path(__file__).parent.parent.parent / "logs"
+_LOG_DIR.mkdir(exist_ok=True)
+DEBUG_LOG = _LOG_DIR / "parse_debug.jsonl"
+STREAM_LOG = _LOG_DIR / "parse_stream.jsonl"
 
 
-def _write_debug_log(entry: dict) -> None:
-    _DEBUG_LOG.parent.mkdir(exist_ok=True)
-    with _DEBUG_LOG.open("a") as f:
-        f.write(json.dumps(entry, indent=None) + "\n")
+# Log entries are queued by the request handler and written to disk by one
+# background task per file (started in the app lifespan), so the request
+# path never blocks on file I/O. Entries are dropped if the queue is full.
+LOG_QUEUE_SIZE = 1000
+# Writes land in a 64 KiB userspace buffer that is flushed once the queue
+# has been idle this long (and on shutdown), not after every entry
+_LOG_FLUSH_INTERVAL_S = 1.0
+# Upper bound on each shutdown step (queueing the sentinel, draining)
+_LOG_STOP_TIMEOUT_S = 5.0
+
+
+def _write_log(queue: asyncio.Queue, entry: dict) -> None:
+    try:
+        queue.put_nowait(entry)
+    except asyncio.QueueFull:
+        logger.warning("Log queue full — dropping entry")
+
+
+def _append_jsonl(f, entries: list[dict]) -> None:
+    f.writelines(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE) for entry in entries)
+
+
+async def run_log_writer(queue: asyncio.Queue, path: Path) -> None:
+    """
+    Drain queued log entries to the JSONL file at path in batches.
+
+    Runs until a None sentinel is queued; everything queued before it is
+    written out and the file is flushed on close.
+    """
+    with path.open("ab", buffering=1 << 16) as f:
+        unflushed = False
+        while True:
+            try:
+                entry = await asyncio.wait_for(queue.get(), timeout=_LOG_FLUSH_INTERVAL_S)
+            except asyncio.TimeoutError:
+                if unflushed:
+                    await asyncio.to_thread(f.flush)
+                    unflushed = False
+                continue
+            # Batch up to the sentinel wherever it lands; anything queued
+            # after it arrived during shutdown and is not written
+            batch = []
+            while entry is not None:
+                batch.append(entry)
+                if queue.empty():
+                    break
+                entry = queue.get_nowait()
+            stopping = entry is None
+            if batch:
+                await asyncio.to_thread(_append_jsonl, f, batch)
+            if stopping:
+                return
+            unflushed = True
+
+
+def _log_writer_done(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("Log writer %s stopped", task.get_name(), exc_info=task.exception())
+
+
+def start_log_writer(queue: asyncio.Queue, path: Path) -> asyncio.Task:
+    """Start run_log_writer as a task whose failure is logged, not swallowed."""
+    task = asyncio.create_task(run_log_writer(queue, path), name=f"log-writer:{path.name}")
+    task.add_done_callback(_log_writer_done)
+    return task
+
+
+async def stop_log_writer(queue: asyncio.Queue, task: asyncio.Task) -> None:
+    """
+    Stop a log writer, letting it drain and flush what is already queued.
+
+    A writer that already died is skipped; one that cannot take the
+    sentinel or finish within _LOG_STOP_TIMEOUT_S is cancelled, and one
+    that fails while draining does not raise, so shutdown never hangs or
+    aborts on the log.
+    """
+    if task.done():
+        return
+    try:
+        await asyncio.wait_for(queue.put(None), timeout=_LOG_STOP_TIMEOUT_S)
+        await asyncio.wait_for(task, timeout=_LOG_STOP_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        task.cancel()
+        logger.warning("Log writer %s did not stop in time — cancelled", task.get_name())
+    except Exception:
+        # The writer failed while draining; _log_writer_done already logged it
+        pass
+
+
+# Exact-match cache of /parse_new results, keyed on a hash of the LaTeX.
+# Repeat formulas skip the LLM round-trip entirely; oldest entries are
+# evicted first once the cache is full.
+_PARSE_CACHE_MAXSIZE = 1024
+_PARSE_CACHE_TTL_S = 24 * 60 * 60
+_parse_cache: OrderedDict[str, tuple[float, TestParseResponse]] = OrderedDict()
+
+
+def _parse_cache_key(latex: str) -> str:
+    return hashlib.blake2b(latex.encode(), digest_size=16).hexdigest()
+
+
+def _parse_cache_get(key: str) -> TestParseResponse | None:
+    entry = _parse_cache.get(key)
+    if entry is None:
+        return None
+    expires_at, response = entry
+    if expires_at < time.monotonic():
+        del _parse_cache[key]
+        return None
+    _parse_cache.move_to_end(key)
+    return response
+
+
+def _parse_cache_put(key: str, response: TestParseResponse) -> None:
+    _parse_cache[key] = (time.monotonic() + _PARSE_CACHE_TTL_S, response)
+    _parse_cache.move_to_end(key)
+    if len(_parse_cache) > _PARSE_CACHE_MAXSIZE:
+        _parse_cache.popitem(last=False)
+
+
+def _project_component(c: dict) -> dict:
+    """
+    Keep only the ComponentBreakdown fields of an LLM component.
+
+    PARSE_SCHEMA requires symbol and counterpart, so they are indexed
+    directly; role is not part of the schema and defaults to empty.
+    """
+    return {
+        "symbol": c["symbol"],
+        "counterpart": c["counterpart"],
+        "role": c.get("role", ""),
+    }
+
+
+def _build_parse_response(latex: str, result: dict, components: list[dict]) -> TestParseResponse:
+    """
+    Build the TestParseResponse for post-processed LLM output.
+
+    The output was produced under strict JSON-schema mode, so by default the
+    models are assembled with model_construct and skip re-validation.
+    """
+    if settings.validate_parse_output:
+        return TestParseResponse(
+            latex=latex,
+            explanation=result["explanation"],
+            components=list(map(_project_component, components)),
+        )
+    return TestParseResponse.model_construct(
+        latex=latex,
+        explanation=result["explanation"],
+        components=[
+            ComponentBreakdown.model_construct(**_project_component(c))
+            for c in components
+        ],
+    )
 
 
 def extract_raw_text(resp) -> str:
     """Extract text from response output items, even if truncated."""
-    parts = []
-    for item in resp.output:
-        content = getattr(item, "content", None)
-        if not content:
-            continue
-        for block in content:
-            text = getattr(block, "text", None)
-            if text:
-                parts.append(text)
-    return "".join(parts) or "(empty)"
+    return "".join(
+        text
+        for item in resp.output
+        for block in (getattr(item, "content", None) or ())
+        if (text := getattr(block, "text", None))
+    ) or "(empty)"
+
+
+# In-flight /parse_new LLM calls, keyed like the cache. Concurrent requests for
+# the same LaTeX await one shared task instead of each paying for a round-trip.
+_parse_inflight: dict[str, asyncio.Task] = {}
+
+
+async def cancel_inflight_parses() -> None:
+    """
+    Cancel and await /parse_new calls still running at shutdown.
+
+    They are shielded from their requests, so nothing else stops them before
+    the OpenAI client and the log writers are closed.
+    """
+    tasks = list(_parse_inflight.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
 
 @router.post("/parse_new", response_model=TestParseResponse)
 async def parse_formula_test(latex: str, request: Request):
-    client = request.app.state.openai
+    cache_key = _parse_cache_key(latex)
+    cached = _parse_cache_get(cache_key)
+    if cached is not None:
+        logger.info("Parse: cache hit | latex=%s", latex[:80])
+        return cached
+
+    task = _parse_inflight.get(cache_key)
+    if task is None:
+        task = asyncio.create_task(_parse_with_llm(request.app.state, latex, cache_key))
+        _parse_inflight[cache_key] = task
+        task.add_done_callback(lambda _: _parse_inflight.pop(cache_key, None))
+    else:
+        logger.info("Parse: joining in-flight request | latex=%s", latex[:80])
+
+    # Shielded so one caller disconnecting doesn't cancel the shared call
+    return await asyncio.shield(task)
+
+
+async def _parse_with_llm(state, latex: str, cache_key: str) -> TestParseResponse:
+    client = state.openai
 
     t0 = time.monotonic()
     try:
@@ -51,10 +242,10 @@ async def parse_formula_test(latex: str, request: Request):
             model="gpt-5.1",
             instructions=PARSE_PROMPT,
             input=f"Return JSON for: {latex}",
-            text={"format": PARSE_SCHEMA},
+            text=PARSE_TEXT_FORMAT,
             reasoning={"effort": "none"}
         )
-        result = json.loads(resp.output_text)
+        result = orjson.loads(resp.output_text)
     except Exception as e:
         logger.error("Parse failed for: %s", latex[:80], exc_info=True)
         raise HTTPException(status_code=502, detail=f"Formula parsing failed: {e}")
@@ -64,35 +255,28 @@ async def parse_formula_test(latex: str, request: Request):
     if not components:
         raise HTTPException(status_code=422, detail="No components identified — LaTeX may be malformed.")
 
-    response = TestParseResponse(
-        latex=latex,
-        explanation=result["explanation"],
-        components=[
-            {
-                "symbol": c.get("symbol", []),
-                "counterpart": c.get("counterpart", ""),
-                "role": c.get("role", ""),
-            }
-            for c in components
-        ],
-    )
+    response = _build_parse_response(latex, result, components)
     t_post = time.monotonic()
 
     usage = resp.usage
     out_details = getattr(usage, "output_tokens_details", None)
     reasoning_tokens = getattr(out_details, "reasoning_tokens", None)
+    # PARSE_PROMPT is a fixed prefix, so OpenAI's prompt caching should serve
+    # most input tokens from cache after the first request
+    in_details = getattr(usage, "input_tokens_details", None)
+    cached_tokens = getattr(in_details, "cached_tokens", None) or 0
     llm_s = t_llm - t0
     post_s = t_post - t_llm
     tok_per_s = usage.output_tokens / llm_s if llm_s > 0 else 0
 
     logger.info(
-        "Parse: total=%.2fs (llm=%.2fs post=%.3fs) | %.0f tok/s | %d components | in=%d out=%d%s",
+        "Parse: total=%.2fs (llm=%.2fs post=%.3fs) | %.0f tok/s | %d components | in=%d (cached=%d) out=%d%s",
         t_post - t0, llm_s, post_s, tok_per_s, len(components),
-        usage.input_tokens, usage.output_tokens,
+        usage.input_tokens, cached_tokens, usage.output_tokens,
         f" (reasoning={reasoning_tokens})" if reasoning_tokens else "",
     )
 
-    _write_debug_log({
+    _write_log(state.debug_log_queue, {
         "ts": time.time(),
         "type": "response",
         "timing": {
@@ -103,13 +287,14 @@ async def parse_formula_test(latex: str, request: Request):
         },
         "usage": {
             "input_tokens": usage.input_tokens,
+            "cached_tokens": cached_tokens,
             "output_tokens": usage.output_tokens,
             "reasoning_tokens": reasoning_tokens,
         },
         "response": response.model_dump(),
     })
-    
 
+    _parse_cache_put(cache_key, response)
     return response
 
 
@@ -129,13 +314,40 @@ async def parse_formula(response: TestParseResponse):
 # Streaming endpoint — SSE wrapper around the same parsing pipeline
 # ---------------------------------------------------------------------------
 
-_STREAM_LOG = Path(__file__).parent.parent.parent / "logs" / "parse_stream.jsonl"
+# SSE framing, pre-encoded: events are yielded as bytes so StreamingResponse
+# sends them without a per-chunk str format and encode
+_EVT_CHUNK = b"event: chunk\ndata: "
+_EVT_COMPLETE = b"event: complete\ndata: "
+_EVT_ERROR = b"event: error\ndata: "
+_EVT_END = b"\n\n"
+
+# Deltas are batched into one 'chunk' event until this much time has passed
+# since the last event or this many characters are pending
+_SSE_FLUSH_INTERVAL_S = 0.025
+_SSE_FLUSH_CHARS = 512
+
 
+def _sse_chunk(text: str, number: int, elapsed: float) -> bytes:
+    return _EVT_CHUNK + orjson.dumps({
+        "chunk": text,
+        "chunk_number": number,
+        "elapsed_s": round(elapsed, 3),
+    }) + _EVT_END
 
-def _write_stream_log(entry: dict) -> None:
-    _STREAM_LOG.parent.mkdir(exist_ok=True)
-    with _STREAM_LOG.open("a") as f:
-        f.write(json.dumps(entry, indent=None) + "\n")
+
+def _finalize_stream(accumulated: str, latex: str) -> tuple[int, dict, bytes] | None:
+    """
+    Decode and post-process a completed stream's JSON output.
+
+    Returns (component count, dumped TestParseResponse, encoded SSE payload),
+    or None when no components survive post-processing.
+    """
+    result = orjson.loads(accumulated)
+    components = merge_fragmented_components(result.get("components", []), latex)
+    if not components:
+        return None
+    dumped = _build_parse_response(latex, result, components).model_dump()
+    return len(components), dumped, orjson.dumps(dumped)
 
 
 @router.post("/parse_new/stream")
@@ -146,16 +358,21 @@ async def parse_formula_stream(latex: str, request: Request):
     final processed TestParseResponse as a 'complete' event.
     """
     client = request.app.state.openai
+    stream_log_queue = request.app.state.stream_log_queue
 
     async def event_stream():
         t0 = time.monotonic()
-        accumulated = ""
+        buf: list[str] = []
         chunk_count = 0
+        pending: list[str] = []  # deltas not yet sent to the client
+        pending_chars = 0
+        frame_count = 0
+        t_last_flush = None
         t_first_token = None   # TTFT: time of first content chunk
         t_last_token = None    # time of last content chunk
 
         logger.info("STREAM START | latex=%s", latex[:80])
-        _write_stream_log({
+        _write_log(stream_log_queue, {
             "ts": time.time(), "event": "start", "latex": latex,
         })
 
@@ -164,8 +381,8 @@ async def parse_formula_stream(latex: str, request: Request):
                 model="gpt-5-mini",
                 instructions=PARSE_PROMPT,
                 input=f"Return JSON for: {latex}",
-                text={"format": PARSE_SCHEMA},
-                reasoning={"effort": "low"},
+                text=PARSE_TEXT_FORMAT,
+                reasoning={"effort": "minimal"},
                 stream=True,
             )
 
@@ -176,7 +393,9 @@ async def parse_formula_stream(latex: str, request: Request):
                 if event_type == "response.output_text.delta":
                     now = time.monotonic()
                     delta = event.delta
-                    accumulated += delta
+                    buf.append(delta)
+                    pending.append(delta)
+                    pending_chars += len(delta)
                     chunk_count += 1
 
                     if t_first_token is None:
@@ -185,51 +404,51 @@ async def parse_formula_stream(latex: str, request: Request):
 
                     elapsed = now - t0
 
-                    logger.info(
-                        "STREAM CHUNK #%d | +%d chars | %.2fs | snippet: %s",
-                        chunk_count, len(delta), elapsed,
-                        repr(delta[:60]),
-                    )
-
-                    # SSE: send each chunk as a 'chunk' event
-                    sse_data = json.dumps({
-                        "chunk": delta,
-                        "chunk_number": chunk_count,
-                        "elapsed_s": round(elapsed, 3),
-                    })
-                    yield f"event: chunk\ndata: {sse_data}\n\n"
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info(
+                            "STREAM CHUNK #%d | +%d chars | %.2fs | snippet: %s",
+                            chunk_count, len(delta), elapsed,
+                            repr(delta[:60]),
+                        )
+
+                    # SSE: coalesce deltas into one 'chunk' event per flush
+                    # window; the first delta goes out immediately
+                    if (
+                        t_last_flush is None
+                        or now - t_last_flush >= _SSE_FLUSH_INTERVAL_S
+                        or pending_chars >= _SSE_FLUSH_CHARS
+                    ):
+                        frame_count += 1
+                        yield _sse_chunk("".join(pending), frame_count, elapsed)
+                        pending.clear()
+                        pending_chars = 0
+                        t_last_flush = now
 
                 # Response completed — process the full result
                 elif event_type == "response.completed":
                     t_stream_done = time.monotonic()
+                    if pending:
+                        frame_count += 1
+                        yield _sse_chunk("".join(pending), frame_count, t_stream_done - t0)
+                        pending.clear()
                     resp = event.response
                     usage = resp.usage
                     out_details = getattr(usage, "output_tokens_details", None)
                     reasoning_tokens = getattr(out_details, "reasoning_tokens", None)
+                    in_details = getattr(usage, "input_tokens_details", None)
+                    cached_tokens = getattr(in_details, "cached_tokens", None) or 0
 
-                    # Parse and post-process exactly like /parse_new
-                    result = json.loads(accumulated)
-                    components = merge_fragmented_components(
-                        result.get("components", []), latex
-                    )
+                    # Parse and post-process exactly like /parse_new, in a
+                    # worker thread so other streams keep flowing meanwhile
+                    accumulated = "".join(buf)
+                    finalized = await asyncio.to_thread(_finalize_stream, accumulated, latex)
 
-                    if not components:
-                        err = json.dumps({"error": "No components identified"})
-                        yield f"event: error\ndata: {err}\n\n"
+                    if finalized is None:
+                        err = orjson.dumps({"error": "No components identified"})
+                        yield _EVT_ERROR + err + _EVT_END
                         return
 
-                    response = TestParseResponse(
-                        latex=latex,
-                        explanation=result["explanation"],
-                        components=[
-                            {
-                                "symbol": c.get("symbol", []),
-                                "counterpart": c.get("counterpart", ""),
-                                "role": c.get("role", ""),
-                            }
-                            for c in components
-                        ],
-                    )
+                    n_components, dumped, complete_data = finalized
                     t_post = time.monotonic()
 
                     # Latency breakdown
@@ -241,17 +460,16 @@ async def parse_formula_stream(latex: str, request: Request):
 
                     logger.info(
                         "STREAM DONE | total=%.2fs (ttft=%.3fs gen=%.2fs post=%.3fs) | "
-                        "%.0f tok/s | %d chunks | %d components | in=%d out=%d%s",
+                        "%.0f tok/s | %d chunks | %d components | in=%d (cached=%d) out=%d%s",
                         total_s, ttft_s, gen_s, post_s,
-                        tok_per_s, chunk_count, len(components),
-                        usage.input_tokens, usage.output_tokens,
+                        tok_per_s, chunk_count, n_components,
+                        usage.input_tokens, cached_tokens, usage.output_tokens,
                         f" (reasoning={reasoning_tokens})" if reasoning_tokens else "",
                     )
 
-                    complete_data = json.dumps(response.model_dump())
-                    yield f"event: complete\ndata: {complete_data}\n\n"
+                    yield _EVT_COMPLETE + complete_data + _EVT_END
 
-                    _write_stream_log({
+                    _write_log(stream_log_queue, {
                         "ts": time.time(),
                         "event": "complete",
                         "latex": latex,
@@ -263,13 +481,15 @@ async def parse_formula_stream(latex: str, request: Request):
                             "tok_per_s": round(tok_per_s, 1),
                         },
                         "chunk_count": chunk_count,
+                        "frame_count": frame_count,
                         "total_chars": len(accumulated),
                         "usage": {
                             "input_tokens": usage.input_tokens,
+                            "cached_tokens": cached_tokens,
                             "output_tokens": usage.output_tokens,
                             "reasoning_tokens": reasoning_tokens,
                         },
-                        "response": response.model_dump(),
+                        "response": dumped,
                     })
 
         except Exception as e:
@@ -277,13 +497,13 @@ async def parse_formula_stream(latex: str, request: Request):
             logger.error(
                 "STREAM ERROR | %.2fs | %s", elapsed, str(e), exc_info=True
             )
-            _write_stream_log({
+            _write_log(stream_log_queue, {
                 "ts": time.time(), "event": "error",
                 "latex": latex, "elapsed_s": round(elapsed, 2),
                 "error": str(e),
             })
-            err = json.dumps({"error": str(e)})
-            yield f"event: error\ndata: {err}\n\n"
+            err = orjson.dumps({"error": str(e)})
+            yield _EVT_ERROR + err + _EVT_END
 
     return StreamingResponse(
         event_stream(),
@@ -26,3 +26,7 @@ PARSE_SCHEMA = {
         "additionalProperties": False,
     },
 }
+
+# Shared `text` argument for client.responses.create; built once at import
+# instead of wrapping PARSE_SCHEMA in a fresh dict on every request
+PARSE_TEXT_FORMAT = {"format": PARSE_SCHEMA}
@@ -1,6 +1,9 @@
 """Post-processing utilities for LLM parse responses."""
 import logging
 import re
+import sys
+from functools import lru_cache
+from itertools import accumulate
 
 logger = logging.getLogger("app.api.parse_utils")
 
@@ -13,25 +16,46 @@ _SYNTACTIC_GLUE = {
 }
 
 # Bare exponents/subscripts: ^{...} or _{...} with nothing else
-_BARE_MODIFIER_RE = re.compile(
-    r'^[\^_]\{[^{}]*\}$'   # ^{2}, _{i}, ^{n+1}, etc.
-    r'|^[\^_][a-zA-Z0-9]$' # ^2, _i, etc.
+_BARE_MODIFIER = (
+    r'[\^_]\{[^{}]*\}'   # ^{2}, _{i}, ^{n+1}, etc.
+    r'|[\^_][a-zA-Z0-9]'  # ^2, _i, etc.
 )
 
+# Glue operators and bare modifiers in one alternation, surrounding
+# whitespace allowed, so a single fullmatch replaces strip + set + regex
+_GLUE_RE = re.compile(
+    r'\s*(?:'
+    + "|".join(re.escape(g) for g in sorted(_SYNTACTIC_GLUE, key=len, reverse=True))
+    + "|" + _BARE_MODIFIER
+    + r')\s*'
+)
+
+
+# The operators plus the bare modifiers that recur most, as literals: these
+# resolve with one set lookup and never reach the regex
+_COMMON_GLUE = frozenset(
+    _SYNTACTIC_GLUE
+    | {f"{m}{{{c}}}" for m in "^_" for c in "0123456789ijklmnNT"}
+    | {f"{m}{c}" for m in "^_" for c in "0123456789ijklmnNT"}
+)
 
-def _is_syntactic_glue(symbol: str) -> bool:
-    """Check if a symbol is syntactic glue (bare operator or bare modifier)."""
-    stripped = symbol.strip()
-    return stripped in _SYNTACTIC_GLUE or bool(_BARE_MODIFIER_RE.match(stripped))
 
+# First one or two characters of every glue form; anything else is rejected
+# with a hash probe before reaching the regex
+_GLUE_PREFIXES = frozenset(g[:2] for g in _SYNTACTIC_GLUE) | {"^", "_"}
 
-def _normalize_symbol(sym) -> list[str]:
-    """Ensure symbol is a list of strings, handling both old (str) and new (list) formats."""
-    if isinstance(sym, list):
-        return sym
-    if isinstance(sym, str):
-        return [sym]
-    return []
+
+@lru_cache(maxsize=2048)
+def _matches_glue(symbol: str) -> bool:
+    head = symbol.lstrip()[:2]
+    if head not in _GLUE_PREFIXES and head[:1] not in _GLUE_PREFIXES:
+        return False
+    return _GLUE_RE.fullmatch(symbol) is not None
+
+
+def _is_syntactic_glue(symbol: str) -> bool:
+    """Check if a symbol is syntactic glue (bare operator or bare modifier)."""
+    return symbol in _COMMON_GLUE or _matches_glue(symbol)
 
 
 def _merge_duplicate_counterparts(components: list[dict]) -> list[dict]:
@@ -48,63 +72,111 @@ def _merge_duplicate_counterparts(components: list[dict]) -> list[dict]:
 
     The first occurrence's non-symbol fields (role, etc.) are preserved.
     """
+    if len(components) < 2:
+        return components
+
     seen: dict[str, int] = {}  # counterpart → index in merged list
+    merged_syms: dict[int, set[str]] = {}  # index → symbols of a merged entry
     merged: list[dict] = []
 
     for comp in components:
-        key = comp.get("counterpart", "").strip()
+        # Interned so repeated counterparts and symbols compare by identity
+        key = sys.intern(comp.get("counterpart", "").strip())
         if not key:
             merged.append(comp)
             continue
 
-        if key in seen:
-            # Append this component's symbols to the existing entry
-            existing = merged[seen[key]]
-            existing_syms = _normalize_symbol(existing.get("symbol", []))
-            new_syms = _normalize_symbol(comp.get("symbol", []))
-            # Deduplicate while preserving order
-            combined = list(existing_syms)
-            for s in new_syms:
-                if s not in combined:
-                    combined.append(s)
-            existing["symbol"] = combined
-            logger.info("Merged duplicate counterpart %r: %s", key, combined)
-        else:
+        idx = seen.get(key)
+        if idx is None:
             seen[key] = len(merged)
-            merged.append(dict(comp))  # shallow copy to avoid mutating input
+            merged.append(comp)
+            continue
+
+        # Append this component's symbols to the existing entry, copying it
+        # on its first merge so the caller's dict is never mutated
+        syms = merged_syms.get(idx)
+        if syms is None:
+            existing = merged[idx] = dict(merged[idx])
+            existing["symbol"] = [sys.intern(s) for s in existing.get("symbol") or []]
+            syms = merged_syms[idx] = set(existing["symbol"])
+        combined = merged[idx]["symbol"]
+        # Deduplicate while preserving order
+        for s in comp.get("symbol") or []:
+            s = sys.intern(s)
+            if s not in syms:
+                syms.add(s)
+                combined.append(s)
+        logger.info("Merged duplicate counterpart %r: %s", key, combined)
 
     return merged
 
 
+def _warn_missing_symbols(components: list[dict], latex: str) -> None:
+    """Log symbols that are not verbatim substrings of the input LaTeX."""
+    # Each distinct symbol is checked once with a C-level substring search
+    unique = {s for c in components for s in c.get("symbol") or []}
+    missing = sorted(s for s in unique if s not in latex)
+    if missing:
+        logger.warning("%d symbol(s) not found in LaTeX: %s", len(missing), missing)
+
+
 def merge_fragmented_components(components: list[dict], latex: str) -> list[dict]:
     """
     Post-process LLM components:
     1. Merge components with identical counterpart text into one (combining symbol lists)
     2. Remove components that are syntactic glue (bare operators, bare exponents/subscripts)
+
+    Symbols that do not occur verbatim in the LaTeX are logged as likely
+    hallucinations but left in place.
     """
+    _warn_missing_symbols(components, latex)
+
     # Step 1: merge duplicate counterparts
     components = _merge_duplicate_counterparts(components)
 
     if len(components) < 2:
         return components
 
-    # Step 2: drop syntactic glue
+    # Step 2: drop syntactic glue — a component made only of glue symbols
+    # that all appear inside some other component's symbols
+    # PARSE_SCHEMA is strict and types symbol as list[str], so no str fallback
+    symbols = [c.get("symbol") or [] for c in components]
+    # Linear pre-check: the prompt forbids bare-operator components, so
+    # usually nothing is all-glue and the containment scan is skipped
+    candidates = [
+        i for i, syms in enumerate(symbols)
+        if syms and all(_is_syntactic_glue(s) for s in syms)
+    ]
+    if not candidates:
+        return components
+
+    joined = [" ".join(syms) for syms in symbols]
+    # Every component's text in one NUL-separated blob: a single-symbol
+    # candidate (the usual "=" or "^{2}") is settled by one C-level find
+    # that skips over the candidate's own span
+    blob = "\x00".join(joined)
+    offsets = list(accumulate((len(t) + 1 for t in joined), initial=0))
     glue_indices: set[int] = set()
-    for i, comp in enumerate(components):
-        syms = _normalize_symbol(comp.get("symbol", []))
-        if not syms or not all(_is_syntactic_glue(s) for s in syms):
+    for i in candidates:
+        needles = [s.strip() for s in symbols[i]]
+        if len(needles) == 1 and "\x00" not in needles[0]:
+            own_start, own_end = offsets[i], offsets[i] + len(joined[i])
+            pos = blob.find(needles[0])
+            if own_start <= pos < own_end:
+                pos = blob.find(needles[0], own_end)
+            if pos != -1:
+                glue_indices.add(i)
             continue
-        for j, other in enumerate(components):
+        # Several symbols must all occur inside the same other component
+        for j, other_joined in enumerate(joined):
             if j == i:
                 continue
-            other_syms = _normalize_symbol(other.get("symbol", []))
-            other_joined = " ".join(other_syms)
-            if all(s.strip() in other_joined for s in syms):
+            if all(n in other_joined for n in needles):
                 glue_indices.add(i)
                 break
 
     if glue_indices:
-        dropped = [_normalize_symbol(components[i].get("symbol", [])) for i in glue_indices]
+        dropped = [symbols[i] for i in glue_indices]
         logger.info("Dropping %d glue component(s): %s", len(dropped), dropped)
 
     return [c for i, c in enumerate(components) if i not in glue_indices]
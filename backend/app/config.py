@@ -22,6 +22,21 @@ class Settings(BaseSettings):
         "exp://localhost:8081"
     ]
 
+    # Parse settings
+    # LLM output already passes OpenAI's strict JSON-schema mode, so parse
+    # responses are assembled without re-validation; enable to validate anyway.
+    validate_parse_output: bool = False
+
+    # OCR settings
+    # Pix2Text inference runs on a dedicated thread pool so it never blocks
+    # the event loop. Keep this at 1: every worker shares the one Pix2Text
+    # engine, whose YOLO formula detector is not thread-safe.
+    ocr_max_workers: int = 1
+    # When set (e.g. "http://localhost:8001"), /api/ocr is forwarded to a
+    # standalone OCR service (app.ocr_main) instead of loading Pix2Text in
+    # every API worker.
+    ocr_service_url: str | None = None
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8",
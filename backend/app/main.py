@@ -2,8 +2,10 @@
 Eli5y Backend - FastAPI Application
 Main entry point for the Eli5y API server.
 """
+import asyncio
 import logging
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 # Configure logging BEFORE importing app modules
@@ -19,19 +21,59 @@ app_logger.addHandler(handler)
 app_logger.propagate = False  # Don't duplicate to root logger
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from openai import AsyncOpenAI
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 from app.config import settings
-from app.api import ocr, parse, chat
+from app.api import parse, chat
 from dotenv import load_dotenv
 load_dotenv()
 
+# With a standalone OCR service configured, this process only proxies OCR
+# requests and never imports pix2text or loads the model.
+if settings.ocr_service_url:
+    from app.api import ocr_proxy as ocr
+else:
+    from app.api import ocr
+
 
 @asynccontextmanager
 async def lifespan(app):
-    app.state.openai = AsyncOpenAI(timeout=120.0)
+    # One shared client for the app's lifetime: pooled keep-alive connections
+    # skip the TCP+TLS handshake per call, and HTTP/2 multiplexes concurrent
+    # LLM requests over them
+    app.state.openai = AsyncOpenAI(
+        timeout=httpx.Timeout(120.0, connect=5.0),
+        http_client=DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+        ),
+    )
+    if settings.ocr_service_url:
+        app.state.ocr_http = httpx.AsyncClient(base_url=settings.ocr_service_url, timeout=60.0)
+    else:
+        app.state.ocr_pool = ThreadPoolExecutor(
+            max_workers=settings.ocr_max_workers, thread_name_prefix="ocr"
+        )
+    app.state.debug_log_queue = asyncio.Queue(maxsize=parse.LOG_QUEUE_SIZE)
+    app.state.stream_log_queue = asyncio.Queue(maxsize=parse.LOG_QUEUE_SIZE)
+    debug_log_task = parse.start_log_writer(app.state.debug_log_queue, parse.DEBUG_LOG)
+    stream_log_task = parse.start_log_writer(app.state.stream_log_queue, parse.STREAM_LOG)
     yield
+    # Shielded /parse_new calls outlive their requests; stop them before the
+    # client and log queues they use go away
+    await parse.cancel_inflight_parses()
+    # Each writer drains its queue, flushes and closes (bounded, see parse)
+    await asyncio.gather(
+        parse.stop_log_writer(app.state.debug_log_queue, debug_log_task),
+        parse.stop_log_writer(app.state.stream_log_queue, stream_log_task),
+    )
     await app.state.openai.close()
+    if settings.ocr_service_url:
+        await app.state.ocr_http.aclose()
+    else:
+        app.state.ocr_pool.shutdown(cancel_futures=True)
 
 
 # Create FastAPI application
@@ -40,6 +82,7 @@ app = FastAPI(
     description="Semantic syntax highlighter for mathematical knowledge",
     version="0.1.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Configure CORS
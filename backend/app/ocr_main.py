@@ -0,0 +1,52 @@
+"""
+Eli5y OCR Service - FastAPI Application
+Standalone entry point that serves only the OCR route.
+
+Run it as a single worker so the Pix2Text model is loaded exactly once:
+
+    uvicorn app.ocr_main:app --workers 1 --port 8001
+
+and point the main API at it with OCR_SERVICE_URL=http://localhost:8001.
+"""
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+# Configure logging BEFORE importing app modules
+handler = logging.StreamHandler(sys.stdout)
+handler.setFormatter(logging.Formatter("%(levelname)s:    %(name)s - %(message)s"))
+
+app_logger = logging.getLogger("app")
+app_logger.setLevel(logging.DEBUG)
+app_logger.addHandler(handler)
+app_logger.propagate = False
+
+from fastapi import FastAPI
+from app.config import settings
+from app.api import ocr
+
+
+@asynccontextmanager
+async def lifespan(app):
+    app.state.ocr_pool = ThreadPoolExecutor(
+        max_workers=settings.ocr_max_workers, thread_name_prefix="ocr"
+    )
+    yield
+    app.state.ocr_pool.shutdown(cancel_futures=True)
+
+
+app = FastAPI(
+    title="Eli5y OCR Service",
+    description="Formula image to LaTeX recognition",
+    version="0.1.0",
+    lifespan=lifespan,
+)
+
+app.include_router(ocr.router, prefix="/api", tags=["OCR"])
+
+
+@app.get("/health")
+async def health_check():
+    """Health check endpoint."""
+    return {"status": "healthy", "model_loaded": ocr.p2t is not None}
@@ -1,3 +1,5 @@
+from bisect import bisect_right
+from functools import lru_cache
 from typing import List, Optional, Tuple
 import re
 import logging
@@ -8,18 +10,24 @@ logger = logging.getLogger("app.services.formulaTranslation")
 
 # Matches LaTeX commands: \mathrm, \mathop, \frac, etc.
 _COMMAND_RE = re.compile(r'\\[a-zA-Z@]+')
+_find_commands = _COMMAND_RE.finditer
 
 
-def _build_command_mask(latex: str) -> list[bool]:
-    """Return a boolean mask where True = this position is inside a LaTeX command name."""
-    mask = [False] * len(latex)
-    for m in _COMMAND_RE.finditer(latex):
-        for i in range(m.start(), m.end()):
-            mask[i] = True
+@lru_cache(maxsize=256)
+def _build_command_mask(latex: str) -> int:
+    """
+    Return a bitmask where bit i is set = position i is inside a LaTeX command name.
+
+    Cached per LaTeX string (repeat and retried formulas reuse it).
+    """
+    mask = 0
+    for m in _find_commands(latex):
+        start, end = m.span()
+        mask |= ((1 << (end - start)) - 1) << start
     return mask
 
 
-def _find_symbol_in_latex(symbol: str, latex: str, command_mask: list[bool]) -> int:
+def _find_symbol_in_latex(symbol: str, latex: str, command_mask: int) -> int:
     """
     Find symbol in latex, skipping matches that overlap with LaTeX command interiors.
 
@@ -32,26 +40,33 @@ def _find_symbol_in_latex(symbol: str, latex: str, command_mask: list[bool]) ->
     if "\\" in symbol:
         return latex.find(symbol)
 
+    # Window of bits covering the symbol, and the last feasible start
+    window = (1 << len(symbol)) - 1
+    limit = len(latex) - len(symbol)
     start = 0
-    while start <= len(latex) - len(symbol):
+    while start <= limit:
         pos = latex.find(symbol, start)
         if pos == -1:
             return -1
-        if not any(command_mask[pos : pos + len(symbol)]):
+        if not (command_mask >> pos) & window:
             return pos
         start = pos + 1
     return -1
 
 
 def assignIndices(component: ComponentBreakdown, latex: str, explanation: str,
-                  command_mask: Optional[list[bool]] = None) -> Optional[dict]:
+                  command_mask: Optional[int] = None,
+                  symbol_positions: Optional[dict[str, int]] = None,
+                  narrative_start: Optional[int] = None) -> Optional[dict]:
     """
     Return {narrative_span, ranges, latex_parts} or None if the narrative lookup fails.
 
     Each symbol in the component's symbol list is located independently
     in the LaTeX string. Symbols that can't be found are skipped (warned).
+    symbol_positions memoizes lookups for the same latex across components;
+    narrative_start, if given, is the counterpart's precomputed position.
     """
-    startIndex = explanation.find(component.counterpart)
+    startIndex = explanation.find(component.counterpart) if narrative_start is None else narrative_start
     if startIndex == -1:
         logger.warning("Counterpart not found in explanation — dropping component. counterpart=%r, explanation=%r", component.counterpart, explanation[:120])
         return None
@@ -59,17 +74,21 @@ def assignIndices(component: ComponentBreakdown, latex: str, explanation: str,
 
     if command_mask is None:
         command_mask = _build_command_mask(latex)
+    if symbol_positions is None:
+        symbol_positions = {}
 
     ranges: List[Tuple[int, int]] = []
     latex_parts: List[str] = []
     for sym in component.symbol:
-        tex_start = _find_symbol_in_latex(sym, latex, command_mask)
+        tex_start = symbol_positions.get(sym)
+        if tex_start is None:
+            tex_start = symbol_positions[sym] = _find_symbol_in_latex(sym, latex, command_mask)
         if tex_start == -1:
             logger.warning("Symbol not found in latex — skipping. symbol=%r, latex=%r", sym, latex[:120])
             continue
-        tex_end = tex_start + len(sym)
-        ranges.append((tex_start, tex_end))
-        latex_parts.append(latex[tex_start:tex_end])
+        ranges.append((tex_start, tex_start + len(sym)))
+        # The match is verbatim, so the symbol itself is the LaTeX slice
+        latex_parts.append(sym)
 
     if not ranges:
         logger.warning("No symbols found in latex for component — dropping. symbols=%r", component.symbol)
@@ -82,11 +101,6 @@ def assignIndices(component: ComponentBreakdown, latex: str, explanation: str,
     }
 
 
-def _range_contains(parent: Tuple[int, int], child: Tuple[int, int]) -> bool:
-    """True if parent range strictly contains child range (not equal)."""
-    return parent[0] <= child[0] and child[1] <= parent[1] and (parent[1] - parent[0]) > (child[1] - child[0])
-
-
 def _compute_children(groups: List[MacroGroup]) -> None:
     """
     Compute parent→children relationships based on range containment.
@@ -100,36 +114,44 @@ def _compute_children(groups: List[MacroGroup]) -> None:
     # contains[i] = set of group indices whose ranges are inside group i
     contains: list[set[int]] = [set() for _ in range(n)]
 
+    # All ranges sorted by start (longest first on ties): a range can only
+    # contain ranges that start inside it, which all follow it in this order,
+    # so each parent range scans just that window instead of every pair
+    flat = sorted(
+        ((r[0], r[1], g) for g, group in enumerate(groups) for r in group.ranges),
+        key=lambda item: (item[0], -item[1]),
+    )
+    # Parallel start/end/group arrays: the window end is one bisect on starts
+    starts, ends, owners = (list(col) for col in zip(*flat)) if flat else ([], [], [])
+    for k, (ps, pe, i) in enumerate(flat):
+        for m in range(k + 1, bisect_right(starts, pe)):
+            j = owners[m]
+            cs, ce = starts[m], ends[m]
+            # Parent range strictly contains child range (not equal)
+            if j != i and ps <= cs <= ce <= pe and pe - ps > ce - cs:
+                contains[i].add(j)
+
+    # Filter to direct children only: anything contained by one of i's own
+    # contained groups is a grandchild — one C-level multi-set difference
     for i in range(n):
-        for j in range(n):
-            if i == j:
-                continue
-            # Check if any of j's ranges is inside any of i's ranges
-            for pr in groups[i].ranges:
-                for cr in groups[j].ranges:
-                    if _range_contains(pr, cr):
-                        contains[i].add(j)
-                        break
-                if j in contains[i]:
-                    break
-
-    # Filter to direct children only: remove grandchildren
-    for i in range(n):
-        direct = set(contains[i])
-        for child in list(contains[i]):
-            # If child itself contains other members of contains[i],
-            # those are grandchildren — remove them from i's direct set
-            grandchildren = contains[child] & contains[i]
-            direct -= grandchildren
-        groups[i].children = sorted(direct)
+        groups[i].children = sorted(contains[i].difference(*(contains[c] for c in contains[i])))
 
 
 def convertParseResponse(response: TestParseResponse) -> MacroMap:
     latex, explanation, components = response.latex, response.explanation, response.components
-    command_mask = _build_command_mask(latex)
+    # The mask only matters for symbols without a backslash; skip the scan
+    # when every symbol is a LaTeX expression that bypasses it
+    need_mask = any("\\" not in sym for c in components for sym in c.symbol)
+    command_mask = _build_command_mask(latex) if need_mask else 0
+    symbol_positions: dict[str, int] = {}
+    # One explanation scan per distinct counterpart
+    narrative_starts = {cp: explanation.find(cp) for cp in {c.counterpart for c in components}}
     groups = []
     for component in components:
-        indices = assignIndices(component, latex, explanation, command_mask)
+        indices = assignIndices(
+            component, latex, explanation, command_mask, symbol_positions,
+            narrative_starts[component.counterpart],
+        )
         if indices is None:
             continue
         group = MacroGroup(